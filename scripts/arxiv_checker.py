@@ -1,29 +1,44 @@
+import html
 import json
 import os
 import re
-import time
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from collections import deque
+from datetime import datetime, timedelta, timezone
 
 import arxiv
-import requests
+import orjson
+
+from feed_utils import format_date_for_display
+from http_utils import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    TELEGRAM_LIMITER,
+    TELEGRAM_SEND_URL,
+    TELEGRAM_TIMEOUT,
+    make_session,
+)
 
 CONFIG_FILE = "config/arxiv_queries.json"
-HISTORY_FILE = "arxiv_history.json"
-TARGET_TZ = ZoneInfo("Asia/Tehran")
+HISTORY_FILE = "arxiv_history.jsonl"
+LEGACY_HISTORY_FILE = "arxiv_history.json"
 
 # --- Constants ---
 MAX_HISTORY_SIZE = 100
 MAX_NOTIFICATIONS_PER_RUN = 5
+# Fetch a larger batch to filter locally and ensure coverage; one page per
+# search, since the client waits 3 seconds between every page request
+MAX_RESULTS_PER_SEARCH = 100
+# Only ask arXiv for papers submitted recently. Announcements can lag
+# submission by several days (weekends, holds), hence the wide margin.
+SUBMISSION_LOOKBACK_DAYS = 7
 ABSTRACT_WORD_LIMIT = 60
+# A zero-width space before the colon keeps Telegram from treating the time
+# as a clickable timestamp
+DISPLAY_TIME_SEP = "\u200b:"
 
+_SESSION = make_session(4)
 
-def format_date_for_display(dt_utc: datetime) -> str:
-    try:
-        dt_local = dt_utc.astimezone(TARGET_TZ)
-        return dt_local.strftime("%Y-%m-%d %H​:%M")
-    except Exception:
-        return "Unknown Date"
+TELEGRAM_TOPIC_ID = os.environ.get("TELEGRAM_ARXIV_TOPIC_ID")
 
 
 def clean_abstract(text: str, word_limit: int) -> str:
@@ -37,12 +52,57 @@ def clean_abstract(text: str, word_limit: int) -> str:
     return " ".join(words)
 
 
-def send_telegram_message(paper, matched_keywords: list, search_name: str) -> bool:
-    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
-    topic_id = os.environ.get("TELEGRAM_ARXIV_TOPIC_ID")
+def with_submission_window(query_str: str, now_utc: datetime) -> str:
+    """Restricts a search query to papers submitted within the lookback window."""
+    start = now_utc - timedelta(days=SUBMISSION_LOOKBACK_DAYS)
+    return (
+        f"({query_str}) AND submittedDate:"
+        f"[{start:%Y%m%d%H%M} TO {now_utc:%Y%m%d%H%M}]"
+    )
+
+
+def compile_keyword_pattern(keywords: list) -> re.Pattern:
+    """
+    Builds one case-insensitive pattern matching any keyword on word boundaries.
+    Longest keywords come first so the most specific one wins at a position;
+    the lookahead keeps matches zero-width so keywords starting later inside
+    a match are still found.
+    Spaces inside a keyword match any whitespace (abstracts are line-wrapped).
+    """
+    alternation = "|".join(
+        re.escape(k).replace(r"\ ", r"\s+")
+        for k in sorted(keywords, key=len, reverse=True)
+    )
+    return re.compile(r"(?=\b(" + alternation + r")\b)", re.IGNORECASE)
+
+
+def compile_keyword_prefixes(keywords: list) -> list:
+    """
+    Pairs each keyword with a pattern anchored at the start of a matched span.
+    The alternation reports only the longest keyword at each position, so
+    these credit the shorter ones sharing its start ("Continual" in
+    "Continual Learning").
+    """
+    return [(k, re.compile(re.escape(k) + r"\b", re.IGNORECASE)) for k in keywords]
+
+
+def match_keywords(paper, keyword_pattern: re.Pattern, keyword_prefixes: list) -> list:
+    """Returns the configured keywords found in the paper's title or abstract."""
+    spans = set()
+    for text in (paper.title, paper.summary):
+        if text:
+            spans.update(" ".join(m.split()) for m in keyword_pattern.findall(text))
+    return list(
+        dict.fromkeys(
+            k
+            for k, prefix in keyword_prefixes
+            if any(prefix.match(span) for span in spans)
+        )
+    )
+
 
-    if not bot_token or not chat_id:
+def send_telegram_message(paper, matched_keywords: list, search_name: str) -> bool:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Error: Missing Telegram secrets.")
         return False
 
@@ -51,7 +111,7 @@ def send_telegram_message(paper, matched_keywords: list, search_name: str) -> bo
     published_date = paper.published
 
     # Format Date
-    published_display = format_date_for_display(published_date)
+    published_display = format_date_for_display(published_date, DISPLAY_TIME_SEP)
 
     # Format Keywords
     tags = " ".join([f"#{k.replace(' ', '')}" for k in matched_keywords])
@@ -63,25 +123,30 @@ def send_telegram_message(paper, matched_keywords: list, search_name: str) -> bo
     pdf_link = paper.pdf_url
     abs_link = paper.entry_id
 
+    # Escape everything interpolated into the HTML message
     message = (
-        f"<b>{title}</b>\n\n"
-        f"<i>{abstract_excerpt}</i>\n\n"
-        f"🏷 {tags}\n"
+        f"<b>{html.escape(title, quote=False)}</b>\n\n"
+        f"<i>{html.escape(abstract_excerpt, quote=False)}</i>\n\n"
+        f"🏷 {html.escape(tags, quote=False)}\n"
         f"📅 {published_display}\n\n"
-        f"🔗 <a href='{abs_link}'>Abstract</a> | <a href='{pdf_link}'>PDF</a>"
+        f"🔗 <a href='{html.escape(abs_link)}'>Abstract</a> | "
+        f"<a href='{html.escape(pdf_link)}'>PDF</a>"
     )
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
-        "chat_id": chat_id,
-        "message_thread_id": topic_id,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "message_thread_id": TELEGRAM_TOPIC_ID,
         "text": message,
         "parse_mode": "HTML",
         "link_preview_options": {"url": abs_link},
     }
 
+    TELEGRAM_LIMITER.acquire()
+
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(
+            TELEGRAM_SEND_URL, json=payload, timeout=TELEGRAM_TIMEOUT
+        )
         response.raise_for_status()
         print(f"Sent notification for: {title}")
         return True
@@ -91,25 +156,55 @@ def send_telegram_message(paper, matched_keywords: list, search_name: str) -> bo
 
 
 def load_history() -> list:
-    """Returns a list of paper IDs."""
+    """
+    Returns a list of paper IDs, oldest first.
+    The history file is append-only JSONL (one ID per line); the old
+    single-list JSON file is read once as a fallback for migration.
+    """
+    ids = []
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
+        with open(HISTORY_FILE, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    ids.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue
+
+    if not ids and os.path.exists(LEGACY_HISTORY_FILE):
+        with open(LEGACY_HISTORY_FILE, "rb") as f:
             try:
-                data = json.load(f)
+                data = orjson.loads(f.read())
                 if isinstance(data, list):
-                    return data
-            except json.JSONDecodeError:
+                    ids = data
+            except orjson.JSONDecodeError:
                 pass
-    return []
+        # Seed the new file so the appends below build on the old history
+        save_history(ids)
+
+    return ids
+
+
+def append_history(new_ids: list) -> None:
+    with open(HISTORY_FILE, "ab") as f:
+        for paper_id in new_ids:
+            f.write(orjson.dumps(paper_id) + b"\n")
 
 
 def save_history(history: list) -> None:
-    # Truncate to keep only the last N entries
+    """Rewrites the history file, keeping only the last N entries."""
     if len(history) > MAX_HISTORY_SIZE:
         history = history[-MAX_HISTORY_SIZE:]
 
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+    # Write to a temp file and swap it in, so an interrupted compaction can
+    # never leave a truncated history behind
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        for paper_id in history:
+            f.write(orjson.dumps(paper_id) + b"\n")
+    os.replace(tmp_file, HISTORY_FILE)
 
 
 def check_arxiv() -> None:
@@ -120,12 +215,17 @@ def check_arxiv() -> None:
     with open(CONFIG_FILE, "r") as f:
         searches = json.load(f)
 
-    history = set(load_history())  # Use set for O(1) lookups
-    new_history_items = []
+    # Ordered list for the file, set for O(1) lookups
+    history_list = load_history()
+    loaded_count = len(history_list)
+    history = set(history_list)
 
-    client = arxiv.Client(page_size=20, delay_seconds=3.0, num_retries=3)
+    client = arxiv.Client(
+        page_size=MAX_RESULTS_PER_SEARCH, delay_seconds=3.0, num_retries=3
+    )
 
     notifications_sent = 0
+    now_utc = datetime.now(timezone.utc)
 
     for search_config in searches:
         if notifications_sent >= MAX_NOTIFICATIONS_PER_RUN:
@@ -138,57 +238,54 @@ def check_arxiv() -> None:
 
         print(f"Running search: {name} ({query_str})...")
 
+        keyword_pattern = compile_keyword_pattern(keywords) if keywords else None
+        keyword_prefixes = compile_keyword_prefixes(keywords)
+
         # Search for recent papers sorted by submission date
         search = arxiv.Search(
-            query=query_str,
-            max_results=100, # Fetch a larger batch to filter locally and ensure coverage
+            query=with_submission_window(query_str, now_utc),
+            max_results=MAX_RESULTS_PER_SEARCH,
             sort_by=arxiv.SortCriterion.SubmittedDate,
             sort_order=arxiv.SortOrder.Descending
         )
 
         try:
             results = list(client.results(search))
-            # Reverse results to process Oldest -> Newest
-            results.reverse()
         except Exception as e:
             print(f"Failed to fetch arxiv results: {e}")
             continue
 
-        for paper in results:
-            if notifications_sent >= MAX_NOTIFICATIONS_PER_RUN:
-                break
+        # Results arrive Newest -> Oldest. Keep only the oldest matches that
+        # fit in this run's budget: appendleft on a bounded deque drops the
+        # newest ones and leaves the queue in Oldest -> Newest order.
+        to_send = deque(maxlen=MAX_NOTIFICATIONS_PER_RUN - notifications_sent)
 
+        for paper in results:
             paper_id = paper.get_short_id()
 
             # Skip if seen
             if paper_id in history:
                 continue
 
-            # Check for Keyword Matches using regex for word boundaries
-            text_to_search = paper.title + " " + paper.summary
-
+            # Check for Keyword Matches in a single pass per field
             matched = []
-            for k in keywords:
-                # \b handles word boundaries. re.IGNORECASE for flexibility.
-                if re.search(
-                    r"\b" + re.escape(k) + r"\b", text_to_search, re.IGNORECASE
-                ):
-                    matched.append(k)
-
-            # Remove duplicates
-            matched = list(set(matched))
+            if keyword_pattern:
+                matched = match_keywords(paper, keyword_pattern, keyword_prefixes)
 
             # Logic: Must match at least one keyword?
             if keywords and not matched:
                 # Add to history even if not matched to avoid re-processing
                 history.add(paper_id)
-                new_history_items.append(paper_id)
+                history_list.append(paper_id)
                 continue
 
             if not keywords:
                 # If no keywords defined, assume we want everything (careful!)
                 matched = ["All"]
 
+            to_send.appendleft((paper, paper_id, matched))
+
+        for paper, paper_id, matched in to_send:
             # It's a match!
             print(f"Match found: {paper.title} [{matched}]")
 
@@ -197,16 +294,14 @@ def check_arxiv() -> None:
             if success:
                 notifications_sent += 1
                 history.add(paper_id)
-                new_history_items.append(paper_id)
-                time.sleep(1)  # Rate limit
-
-    # Save History
-    original_history_list = load_history()
-    for item in new_history_items:
-        if item not in original_history_list:
-            original_history_list.append(item)
-
-    save_history(original_history_list)
+                history_list.append(paper_id)
+
+    # Save History: append only the new IDs, compact once the file has
+    # grown to twice the retained size
+    if len(history_list) > 2 * MAX_HISTORY_SIZE:
+        save_history(history_list)
+    elif len(history_list) > loaded_count:
+        append_history(history_list[loaded_count:])
 
 
 if __name__ == "__main__":
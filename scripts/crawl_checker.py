@@ -1,18 +1,45 @@
+import hashlib
+import html
 import json
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from functools import lru_cache
+from urllib.parse import quote
 
+import orjson
 import requests
 from dateutil import parser as date_parser
 
 # Import extractors
 from extractors.anthropic import AnthropicExtractor
+from feed_utils import format_date_for_display
+from http_utils import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    TELEGRAM_LIMITER,
+    TELEGRAM_SEND_URL,
+    TELEGRAM_TIMEOUT,
+    make_session,
+)
 
 CONFIG_FILE = "config/crawled_feeds.json"
 HISTORY_FILE = "crawl_history.json"
-TARGET_TZ = ZoneInfo("Asia/Tehran")
+# Reserved history key holding per-page validators and extracted items
+PAGE_CACHE_KEY = "__pages__"
+
+# --- Constants ---
+MAX_FETCH_WORKERS = 8
+FETCH_TIMEOUT = 30
+
+# We mimic a browser just in case
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+_SESSION = make_session(MAX_FETCH_WORKERS)
+
+TELEGRAM_TOPIC_ID = os.environ.get("TELEGRAM_BLOG_TOPIC_ID")
 
 # --- Registry ---
 
@@ -21,53 +48,49 @@ EXTRACTORS = {"anthropic": AnthropicExtractor}
 # --- Utils ---
 
 
-def format_date_for_display(dt_utc: datetime) -> str:
+@lru_cache(maxsize=4096)
+def _parse_date_cached(date_str: str) -> datetime:
     try:
-        dt_local = dt_utc.astimezone(TARGET_TZ)
-        return dt_local.strftime("%Y-%m-%d %H:%M")
-    except Exception:
-        return "Unknown Date"
+        # Fast path: ISO 8601 (e.g. Anthropic's publishedOn)
+        dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+    except ValueError:
+        dt = date_parser.parse(date_str)
+
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
 
 
 def parse_date_safe(date_str: str | None) -> datetime:
     """
     Parses a date string into a timezone-aware datetime object.
     Defaults to epoch if parsing fails, to ensure sortability.
+    Results are cached: items are parsed for sorting, filtering and display.
     """
     if not date_str:
         return datetime.fromtimestamp(0, tz=timezone.utc)
     try:
-        dt = date_parser.parse(date_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        else:
-            dt = dt.astimezone(timezone.utc)
-        return dt
+        return _parse_date_cached(date_str)
     except Exception:
         return datetime.fromtimestamp(0, tz=timezone.utc)
 
 
 def send_telegram_message(entry: dict, blog_name: str, rhash: str = None) -> bool:
-    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
-    topic_id = os.environ.get("TELEGRAM_BLOG_TOPIC_ID")
-
-    if not bot_token or not chat_id:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Error: Missing Telegram secrets.")
         return False
 
-    title = entry.get("title", "No Title")
-    original_link = entry.get("link", "")
-    summary = entry.get("summary", "")
-    published_str = entry.get("published_at", "")
+    # Extractors may emit explicit None values
+    title = entry.get("title") or "No Title"
+    original_link = entry.get("link") or ""
+    summary = entry.get("summary") or ""
+    published_str = entry.get("published_at") or ""
 
     # Instant View Logic
     preview_link = original_link
     if rhash and original_link:
-        # Encode original link if necessary
-        import urllib.parse
-
-        encoded_url = urllib.parse.quote(original_link)
+        # Encode the whole link, "/" included, as a single query value
+        encoded_url = quote(original_link, safe="")
         preview_link = f"https://t.me/iv?url={encoded_url}&rhash={rhash}"
 
     # Parse Date
@@ -81,29 +104,36 @@ def send_telegram_message(entry: dict, blog_name: str, rhash: str = None) -> boo
 
     # Format tags
     tags = entry.get("metadata", {}).get("tags", [])
-    tags_str = f"🏷 <i>{', '.join(tags)}</i>\n\n" if tags else ""
+    tags_str = (
+        f"🏷 <i>{html.escape(', '.join(tags), quote=False)}</i>\n\n" if tags else ""
+    )
 
-    summary_section = f"{summary}\n\n" if summary else ""
+    summary_section = f"{html.escape(summary, quote=False)}\n\n" if summary else ""
 
+    # Escape everything interpolated into the HTML message
     message = (
-        f"🕷 <b>{blog_name}</b>\n\n"
-        f"<a href='{original_link}'><b>{title}</b></a>\n\n"
+        f"🕷 <b>{html.escape(blog_name, quote=False)}</b>\n\n"
+        f"<a href='{html.escape(original_link)}'>"
+        f"<b>{html.escape(title, quote=False)}</b></a>\n\n"
         f"{tags_str}"
         f"{summary_section}"
         f"📅 {published_display}\n"
     )
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
-        "chat_id": chat_id,
-        "message_thread_id": topic_id,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "message_thread_id": TELEGRAM_TOPIC_ID,
         "text": message,
         "parse_mode": "HTML",
         "link_preview_options": {"url": preview_link},
     }
 
+    TELEGRAM_LIMITER.acquire()
+
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(
+            TELEGRAM_SEND_URL, json=payload, timeout=TELEGRAM_TIMEOUT
+        )
         response.raise_for_status()
         print(f"Sent notification for: {title}")
         return True
@@ -112,16 +142,37 @@ def send_telegram_message(entry: dict, blog_name: str, rhash: str = None) -> boo
         return False
 
 
+def fetch_page(url: str, cached_page: dict) -> requests.Response:
+    """
+    Fetches a page, revalidating against the cached ETag / Last-Modified
+    when we still hold the items extracted from it (304 -> reuse them).
+    """
+    headers = dict(BROWSER_HEADERS)
+    if "items" in cached_page:
+        if cached_page.get("etag"):
+            headers["If-None-Match"] = cached_page["etag"]
+        if cached_page.get("last_modified"):
+            headers["If-Modified-Since"] = cached_page["last_modified"]
+
+    resp = _SESSION.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp
+
+
 def load_history() -> dict:
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
+        with open(HISTORY_FILE, "rb") as f:
+            return orjson.loads(f.read())
     return {}
 
 
 def save_history(history: dict) -> None:
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+    # Write to a temp file and swap it in, so an interrupted run can never
+    # leave a truncated history behind
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(history))
+    os.replace(tmp_file, HISTORY_FILE)
 
 
 def check_crawlers() -> None:
@@ -133,22 +184,34 @@ def check_crawlers() -> None:
         feeds = json.load(f)
 
     history = load_history()
+    page_cache = history.setdefault(PAGE_CACHE_KEY, {})
     updated_history = False
 
     now_utc = datetime.now(timezone.utc)
     cutoff_time = now_utc - timedelta(hours=24)
 
+    active_feeds = []
     for feed_config in feeds:
-        name = feed_config["name"]
-        url = feed_config["url"]
         extractor_key = feed_config.get("extractor")
-        rhash = feed_config.get("rhash")
-
         if extractor_key not in EXTRACTORS:
-            print(f"Unknown extractor '{extractor_key}' for {name}")
+            print(f"Unknown extractor '{extractor_key}' for {feed_config['name']}")
             continue
-
-        extractor = EXTRACTORS[extractor_key]
+        active_feeds.append(feed_config)
+
+    # Fetch all pages concurrently; processing below stays sequential
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                fetch_page, feed_config["url"], page_cache.get(feed_config["name"], {})
+            )
+            for feed_config in active_feeds
+        ]
+
+    for feed_config, future in zip(active_feeds, futures):
+        name = feed_config["name"]
+        url = feed_config["url"]
+        rhash = feed_config.get("rhash")
+        extractor = EXTRACTORS[feed_config["extractor"]]
 
         if name not in history:
             history[name] = []
@@ -156,30 +219,47 @@ def check_crawlers() -> None:
         print(f"Crawling {name} ({url})...")
 
         try:
-            # We mimic a browser just in case
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            resp = requests.get(url, headers=headers)
-            resp.raise_for_status()
-            html_content = resp.text
+            resp = future.result()
         except Exception as e:
             print(f"Failed to fetch {url}: {e}")
             continue
 
-        try:
-            items = extractor.extract(html_content)
-        except Exception as e:
-            print(f"Extraction failed for {name}: {e}")
-            continue
+        cached_page = page_cache.get(name, {})
+
+        if resp.status_code == 304:
+            print(f"[{name}] Page not modified, reusing cached items.")
+            items = cached_page["items"]
+        else:
+            # Skip re-parsing when the page is byte-identical to last run
+            content_hash = hashlib.sha256(resp.content).hexdigest()
+            if content_hash == cached_page.get("sha256") and "items" in cached_page:
+                items = cached_page["items"]
+            else:
+                try:
+                    items = extractor.extract(resp.text)
+                except Exception as e:
+                    print(f"Extraction failed for {name}: {e}")
+                    continue
+
+            new_page = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "sha256": content_hash,
+                "items": items,
+            }
+            if new_page != cached_page:
+                page_cache[name] = new_page
+                updated_history = True
 
         if not items:
             continue
 
-        # 1. Sort by Date (Newest First)
-        items.sort(key=lambda x: parse_date_safe(x.get("published_at")), reverse=True)
+        # 1. Sort by Date (Oldest First), so notifications go out chronologically
+        items.sort(key=lambda x: parse_date_safe(x.get("published_at")))
 
         to_send = []
+        # The list keeps insertion order for trimming; the set answers lookups
+        seen = set(history[name])
 
         # 2. Process Items
         for item in items:
@@ -188,7 +268,7 @@ def check_crawlers() -> None:
                 continue
 
             # If already seen, skip
-            if link in history[name]:
+            if link in seen:
                 continue
 
             # Check Age: Only notify if it's recent (< 24 hours)
@@ -199,6 +279,7 @@ def check_crawlers() -> None:
             else:
                 # Older item: just cache it silently so we don't process it again
                 history[name].append(link)
+                seen.add(link)
                 updated_history = True
 
         if not to_send:
@@ -208,16 +289,13 @@ def check_crawlers() -> None:
         print(f"[{name}] Found {len(to_send)} new RECENT items.")
 
         # 3. Send Notifications (Oldest -> Newest)
-        # to_send is currently [Newest, ..., Oldest] (because items was sorted Newest First)
-        # We want to send chronologically.
-        for item in reversed(to_send):
+        for item in to_send:
             print(f"New entry found: {item.get('title')}")
             
             if send_telegram_message(item, name, rhash):
                 # Only add to history if sent successfully
                 history[name].append(item.get("link"))
                 updated_history = True
-                time.sleep(1)
 
         # Keep history manageable
         if len(history[name]) > 50:
@@ -2,12 +2,21 @@ import json
 import re
 from typing import Any, Dict, List, Optional
 
-from bs4 import BeautifulSoup
+import lxml.html
+import orjson
 
 
 class AnthropicExtractor:
     BASE_URL = "https://www.anthropic.com"
 
+    # Cheap substring probe; only scripts containing it can hold a payload
+    PAYLOAD_MARKER = "self.__next_f.push("
+
+    # Regex to capture the JSON payload inside self.__next_f.push(...)
+    PAYLOAD_PATTERN = re.compile(
+        r"self\.__next_f\.push\(\[\s*1\s*,\s*\"(.*?)\"\s*\]\s*\)", re.DOTALL
+    )
+
     @staticmethod
     def _standardize_output(
         title: Optional[str],
@@ -28,23 +37,20 @@ class AnthropicExtractor:
     def extract(cls, html_content: str) -> List[Dict[str, Any]]:
         """
         Parses Next.js hydration data using non-greedy Regex to isolate specific chunks.
-        Adapted to work with BeautifulSoup instead of justhtml.
+        Uses lxml (libxml2) and only pulls the text of <script> elements.
         """
-        soup = BeautifulSoup(html_content, "html.parser")
-        scripts = soup.find_all("script")
+        doc = lxml.html.fromstring(html_content)
+        scripts = doc.xpath("//script/text()")
 
         target_articles = []
 
-        # Regex to capture the JSON payload inside self.__next_f.push(...)
-        pattern = re.compile(
-            r"self\.__next_f\.push\(\[\s*1\s*,\s*\"(.*?)\"\s*\]\s*\)", re.DOTALL
-        )
-
-        for script in scripts:
-            if not script.string:
+        for text in scripts:
+            if not text:
                 continue
 
-            text = script.string
+            start = text.find(cls.PAYLOAD_MARKER)
+            if start < 0:
+                continue
 
             # Optimization check
             if (
@@ -54,15 +60,17 @@ class AnthropicExtractor:
             ):
                 continue
 
-            matches = pattern.findall(text)
+            # Start the regex at the first push() call instead of offset 0
+            for match in cls.PAYLOAD_PATTERN.finditer(text, start):
+                raw_payload = match.group(1)
 
-            for raw_payload in matches:
                 # We are looking for either "articles" (Engineering) or "posts" (Research)
                 if "articles" not in raw_payload and "posts" not in raw_payload:
                     continue
 
                 try:
                     # 1. Decode Level 1: JavaScript String -> Valid JSON String
+                    # (stdlib json: the payload may hold raw control chars)
                     unescaped_str = json.loads(f'"{raw_payload}"', strict=False)
 
                     # 2. Remove Chunk ID
@@ -72,7 +80,7 @@ class AnthropicExtractor:
                     _, json_str = unescaped_str.split(":", 1)
 
                     # 3. Decode Level 2: JSON String -> Python Dict/List
-                    data = json.loads(json_str)
+                    data = orjson.loads(json_str)
 
                     # 4. Navigate Next.js Data Structure
                     # Expected: ["$", "RefID", null, {"page": ...}]
@@ -0,0 +1,164 @@
+import calendar
+import email.utils
+import html
+import re
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import feedparser
+import requests
+
+# Dates in messages are shown in this timezone
+TARGET_TZ = ZoneInfo("Asia/Tehran")
+
+# Summaries are short HTML fragments; stripping tags with a regex is
+# enough and much cheaper than building a full parse tree per entry.
+# Only a "<" that can start a tag counts, as html.parser does, so plain-text
+# descriptions (YouTube's are not escaped) keep their "<3" and "a < b".
+_TAG_RE = re.compile(r"<!--.*?-->|</?[A-Za-z][^>]*>|<![^>]*>", re.DOTALL)
+_WORD_RE = re.compile(r"\S+")
+
+
+def clean_summary(html_content: str, word_limit: int = 50) -> str:
+    """
+    Returns the text of an HTML summary, cut to word_limit words.
+
+    >>> clean_summary("<p>Hello <b>world</b> &amp; more</p>")
+    'Hello world & more'
+    >>> clean_summary("I <3 Python, see 0:00 intro -> 5:00 demo")
+    'I <3 Python, see 0:00 intro -> 5:00 demo'
+    >>> clean_summary("Compare A < B and C > D.")
+    'Compare A < B and C > D.'
+    """
+    if not html_content:
+        return ""
+    text = html.unescape(_TAG_RE.sub(" ", html_content))
+
+    # Stop at the word limit instead of splitting a long description in full
+    words: list[str] = []
+    for match in _WORD_RE.finditer(text):
+        if len(words) == word_limit:
+            return " ".join(words) + "..."
+        words.append(match.group())
+    return " ".join(words)
+
+
+def fetch_feed(
+    session: requests.Session, url: str, cached: dict, timeout: float
+) -> requests.Response:
+    """
+    Fetches a feed over the caller's session, revalidating against the
+    stored ETag / Last-Modified (304 -> nothing new).
+    """
+    headers = {"User-Agent": feedparser.USER_AGENT}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("modified"):
+        headers["If-Modified-Since"] = cached["modified"]
+
+    resp = session.get(url, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    return resp
+
+
+@lru_cache(maxsize=1024)
+def _format_epoch_minutes(epoch_minutes: int, time_sep: str) -> str:
+    dt_local = datetime.fromtimestamp(epoch_minutes * 60, tz=TARGET_TZ)
+    return (
+        f"{dt_local.year:04d}-{dt_local.month:02d}-{dt_local.day:02d} "
+        f"{dt_local.hour:02d}{time_sep}{dt_local.minute:02d}"
+    )
+
+
+def format_date_for_display(dt_utc: datetime, time_sep: str = ":") -> str:
+    """
+    Formats a UTC datetime as local "YYYY-MM-DD HH:MM". Display has minute
+    precision, so results are cached on the UTC minute.
+    """
+    try:
+        return _format_epoch_minutes(int(dt_utc.timestamp() // 60), time_sep)
+    except Exception:
+        return "Unknown Date"
+
+
+def _fast_parse(date_str: str) -> datetime:
+    """
+    Tries the formats feeds actually use before falling back to dateutil:
+    ISO 8601 / RFC 3339 (Atom, YouTube), then RFC 822 (RSS).
+    """
+    try:
+        return datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    try:
+        return email.utils.parsedate_to_datetime(date_str)
+    except (TypeError, ValueError):
+        pass
+
+    # Rarely needed, so only pay for the import when a feed uses an odd format
+    from dateutil import parser as date_parser
+
+    return date_parser.parse(date_str)
+
+
+@lru_cache(maxsize=2048)
+def _parse_entry_date(date_str: str) -> datetime:
+    # Feeds repeat the same date strings run after run, so cache on the raw string
+    dt = _fast_parse(date_str)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+@lru_cache(maxsize=2048)
+def _parse_entry_timestamp(date_str: str) -> float:
+    return _parse_entry_date(date_str).timestamp()
+
+
+def _entry_date_fields(entry) -> tuple[str | None, time.struct_time | None]:
+    """
+    Returns the raw date string and feedparser's own parse of it (a UTC
+    struct_time, or None if feedparser could not read the format).
+    """
+    if "published" in entry:
+        return entry.published, entry.get("published_parsed")
+    if "updated" in entry:
+        return entry.updated, entry.get("updated_parsed")
+    return None, None
+
+
+def get_entry_date(entry) -> datetime | None:
+    """
+    Helper to extract, parse, and normalize the date to UTC.
+    Returns a datetime object or None.
+    """
+    date_str, parsed = _entry_date_fields(entry)
+    if date_str is None:
+        return None
+
+    try:
+        # feedparser has usually parsed the date already
+        if parsed:
+            return datetime(*parsed[:6], tzinfo=timezone.utc)
+        return _parse_entry_date(date_str)
+    except Exception:
+        return None
+
+
+def get_entry_timestamp(entry) -> float | None:
+    """
+    Same as get_entry_date, as POSIX seconds: cheap to compare and sort
+    when scanning many entries against a cutoff.
+    """
+    date_str, parsed = _entry_date_fields(entry)
+    if date_str is None:
+        return None
+
+    try:
+        if parsed:
+            return float(calendar.timegm(parsed))
+        return _parse_entry_timestamp(date_str)
+    except Exception:
+        return None
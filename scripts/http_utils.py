@@ -0,0 +1,38 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limit import RateLimiter
+
+TELEGRAM_TIMEOUT = 10
+
+# Telegram settings come from the environment once per run; each checker
+# reads its own topic id
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
+TELEGRAM_SEND_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+# Telegram allows about one message per second in a single chat; all of our
+# notifications go to one chat, so sends are paced (and kept in order) here.
+# A small burst lets the usual 2-3 messages per run go out without waiting.
+TELEGRAM_LIMITER = RateLimiter(rate=1.0, capacity=3)
+
+
+def make_session(pool_maxsize: int) -> requests.Session:
+    """
+    Returns a session that reuses TCP/TLS connections and retries transient
+    failures. pool_maxsize should match the number of threads sharing it.
+    """
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+            ),
+        ),
+    )
+    return session
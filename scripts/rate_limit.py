@@ -0,0 +1,32 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket.
+    Allows bursts of up to `capacity` calls, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available, then consumes it."""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                time.sleep((1 - self._tokens) / self.rate)
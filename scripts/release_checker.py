@@ -1,33 +1,39 @@
+import html
 import json
 import os
-import time
-from datetime import datetime, timezone
-from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
 
+import orjson
 import requests
 from dateutil import parser as date_parser
 
+from feed_utils import format_date_for_display
+from http_utils import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    TELEGRAM_LIMITER,
+    TELEGRAM_SEND_URL,
+    TELEGRAM_TIMEOUT,
+    make_session,
+)
+
 CONFIG_FILE = "config/release_repos.json"
 HISTORY_FILE = "release_history.json"
-TARGET_TZ = ZoneInfo("Asia/Tehran")
 
+# --- Constants ---
+MAX_FETCH_WORKERS = 10
+FETCH_TIMEOUT = 30
 
-def format_date_for_display(dt_utc: datetime) -> str:
-    try:
-        dt_local = dt_utc.astimezone(TARGET_TZ)
-        return dt_local.strftime("%Y-%m-%d %H:%M")
-    except Exception:
-        return "Unknown Date"
+_SESSION = make_session(MAX_FETCH_WORKERS)
+
+TELEGRAM_TOPIC_ID = os.environ.get("TELEGRAM_RELEASE_TOPIC_ID")
 
 
 def send_telegram_message(
     repo: str, tag: str, html_url: str, published_at: str
 ) -> bool:
-    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
-    topic_id = os.environ.get("TELEGRAM_RELEASE_TOPIC_ID")
-
-    if not bot_token or not chat_id:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Error: Missing Telegram secrets.")
         return False
 
@@ -43,24 +49,28 @@ def send_telegram_message(
         except Exception:
             pass
 
+    # Escape everything interpolated into the HTML message
     message = (
-        f"📦 New release for <b>{repo}</b>\n\n"
-        f"<b>Tag:</b> <code>{tag}</code>\n"
+        f"📦 New release for <b>{html.escape(repo, quote=False)}</b>\n\n"
+        f"<b>Tag:</b> <code>{html.escape(tag, quote=False)}</code>\n"
         f"📅 {published_display}\n\n"
-        f"🔗 <a href='{html_url}'>View Release</a>"
+        f"🔗 <a href='{html.escape(html_url or '')}'>View Release</a>"
     )
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
-        "chat_id": chat_id,
-        "message_thread_id": topic_id,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "message_thread_id": TELEGRAM_TOPIC_ID,
         "text": message,
         "parse_mode": "HTML",
         "disable_web_page_preview": False,
     }
 
+    TELEGRAM_LIMITER.acquire()
+
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(
+            TELEGRAM_SEND_URL, json=payload, timeout=TELEGRAM_TIMEOUT
+        )
         response.raise_for_status()
         print(f"Sent notification for: {repo} - {tag}")
         return True
@@ -69,16 +79,54 @@ def send_telegram_message(
         return False
 
 
+def github_headers() -> dict:
+    headers = {"Accept": "application/vnd.github+json"}
+    # Optional: authenticated requests get a much higher rate limit
+    token = os.environ.get("GITHUB_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return headers
+
+
+def fetch_latest_release(repo: str, headers: dict, cached: dict) -> requests.Response:
+    """
+    Fetches the latest release, revalidating against the cached ETag /
+    Last-Modified. Unchanged repos answer 304 with an empty body.
+    """
+    api_url = f"https://api.github.com/repos/{repo}/releases/latest"
+    headers = dict(headers)
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = _SESSION.get(api_url, headers=headers, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+def get_history_entry(history: dict, repo: str) -> dict:
+    entry = history.get(repo)
+    # Older history files stored just the tag string
+    if isinstance(entry, str):
+        return {"tag": entry, "etag": None, "last_modified": None}
+    return entry or {}
+
+
 def load_history() -> dict:
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
+        with open(HISTORY_FILE, "rb") as f:
+            return orjson.loads(f.read())
     return {}
 
 
 def save_history(history: dict) -> None:
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+    # Write to a temp file and swap it in, so an interrupted run can never
+    # leave a truncated history behind
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(history))
+    os.replace(tmp_file, HISTORY_FILE)
 
 
 def check_releases() -> None:
@@ -92,20 +140,40 @@ def check_releases() -> None:
     history = load_history()
     updated_history = False
 
-    for repo_config in repos:
+    headers = github_headers()
+
+    # Query all repos concurrently; history and notifications stay sequential
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                fetch_latest_release,
+                repo_config["repo"],
+                headers,
+                get_history_entry(history, repo_config["repo"]),
+            )
+            for repo_config in repos
+        ]
+
+    for repo_config, future in zip(repos, futures):
         repo = repo_config["repo"]
         print(f"Checking {repo}...")
 
-        api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-
         try:
-            response = requests.get(api_url)
-            response.raise_for_status()
-            data = response.json()
+            response = future.result()
         except Exception as e:
             print(f"Failed to fetch release for {repo}: {e}")
             continue
 
+        if response.status_code == 304:
+            print(f"No new release for {repo}")
+            continue
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            print(f"Failed to parse release for {repo}: {e}")
+            continue
+
         tag = data.get("tag_name")
         html_url = data.get("html_url")
         published_at = data.get("published_at", "")
@@ -114,19 +182,27 @@ def check_releases() -> None:
             print(f"No releases for {repo}")
             continue
 
-        last_seen = history.get(repo)
+        entry = get_history_entry(history, repo)
+        new_entry = {
+            "tag": tag,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
 
-        if tag != last_seen:
+        if tag != entry.get("tag"):
             print(f"NEW RELEASE for {repo}: {tag}")
 
             success = send_telegram_message(repo, tag, html_url, published_at)
 
+            # Keep the old validators on failure so the next run refetches
             if success:
-                history[repo] = tag
+                history[repo] = new_entry
                 updated_history = True
-                time.sleep(1)
         else:
             print(f"No new release for {repo}")
+            if new_entry != history.get(repo):
+                history[repo] = new_entry
+                updated_history = True
 
     if updated_history:
         save_history(history)
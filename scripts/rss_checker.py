@@ -1,80 +1,58 @@
 import argparse
+import html
 import json
 import os
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from urllib.parse import quote
 
 import feedparser
-import requests
-from bs4 import BeautifulSoup
-from dateutil import parser as date_parser
+import orjson
+
+from feed_utils import (
+    clean_summary,
+    fetch_feed,
+    format_date_for_display,
+    get_entry_timestamp,
+)
+from http_utils import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    TELEGRAM_LIMITER,
+    TELEGRAM_SEND_URL,
+    TELEGRAM_TIMEOUT,
+    make_session,
+)
 
 CONFIG_FILE = "config/blog_feeds.json"
 HISTORY_FILE = "rss_history.json"
-TARGET_TZ = ZoneInfo("Asia/Tehran")
+# Sends are appended here as they happen and folded into HISTORY_FILE at the
+# end of a run, so a run that dies halfway still remembers what it sent
+SEND_LOG_FILE = "rss_history.log"
+# Per-feed ETag / Last-Modified validators, kept alongside the id lists
+VALIDATORS_KEY = "__validators__"
 
+# --- Constants ---
+MAX_FETCH_WORKERS = 4
+FETCH_TIMEOUT = 15
+MAX_HISTORY_PER_FEED = 50
 
-def clean_summary(html_content: str, word_limit: int = 50) -> str:
-    if not html_content:
-        return ""
-    soup = BeautifulSoup(html_content, "html.parser")
-    text = soup.get_text(separator=" ")
-    words = text.split()
-    if len(words) > word_limit:
-        return " ".join(words[:word_limit]) + "..."
-    return " ".join(words)
+_SESSION = make_session(MAX_FETCH_WORKERS)
 
-
-def get_entry_date(entry) -> datetime:
-    """
-    Helper to extract, parse, and normalize the date to UTC.
-    Returns a datetime object or None.
-    """
-    if "published" in entry:
-        date_str = entry.published
-    elif "updated" in entry:
-        date_str = entry.updated
-    else:
-        return None
-
-    try:
-        dt = date_parser.parse(date_str)
-        # Ensure it is aware of timezone (UTC)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        else:
-            dt = dt.astimezone(timezone.utc)
-        return dt
-    except Exception:
-        return None
-
-
-def format_date_for_display(dt_utc: datetime) -> str:
-    """
-    Converts UTC datetime object to Target Timezone string.
-    """
-    try:
-        dt_local = dt_utc.astimezone(TARGET_TZ)
-        # Format: 2024-05-20 18:30
-        return dt_local.strftime("%Y-%m-%d %H:%M")
-    except Exception:
-        return "Unknown Date"
+TELEGRAM_TOPIC_ID = os.environ.get("TELEGRAM_BLOG_TOPIC_ID")
 
 
 def send_telegram_message(
     entry: dict,
     blog_name: str,
     dt_utc: datetime,
-    rhash: str = None,
+    rhash: str | None = None,
     force_slash: bool = False,
     cache_burst: bool = False,
 ) -> bool:
-    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
-    topic_id = os.environ.get("TELEGRAM_BLOG_TOPIC_ID")
-
-    if not bot_token or not chat_id:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         print("Error: Missing Telegram secrets.")
         return False
 
@@ -94,10 +72,8 @@ def send_telegram_message(
             separator = "&" if "?" in iv_url else "?"
             iv_url += f"{separator}iv_force={int(time.time())}"
 
-        # Encode original link if necessary
-        import urllib.parse
-
-        encoded_url = urllib.parse.quote(iv_url)
+        # Encode the whole link, "/" included, as a single query value
+        encoded_url = quote(iv_url, safe="")
         preview_link = f"https://t.me/iv?url={encoded_url}&rhash={rhash}"
 
     # Get clean summary
@@ -107,7 +83,7 @@ def send_telegram_message(
     # Format summary as quote
     summary_section = ""
     if summary:
-        summary_section = f"{summary}\n\n"
+        summary_section = f"{html.escape(summary, quote=False)}\n\n"
 
     # Format Date to Tehran Time
     if dt_utc:
@@ -118,24 +94,29 @@ def send_telegram_message(
     # Construct Message
     # Note: We use original_link for the title so clicking it opens the browser.
     # The IV button will appear because we force it in link_preview_options.
+    # Everything interpolated into the HTML message is escaped.
     message = (
-        f"📰 <b>{blog_name}</b>\n\n"
-        f"<a href='{original_link}'><b>{title}</b></a>\n\n"
+        f"📰 <b>{html.escape(blog_name, quote=False)}</b>\n\n"
+        f"<a href='{html.escape(original_link)}'>"
+        f"<b>{html.escape(title, quote=False)}</b></a>\n\n"
         f"{summary_section}"
         f"📅 {published_display}\n"
     )
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     payload = {
-        "chat_id": chat_id,
-        "message_thread_id": topic_id,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "message_thread_id": TELEGRAM_TOPIC_ID,
         "text": message,
         "parse_mode": "HTML",
         "link_preview_options": {"url": preview_link},
     }
 
+    TELEGRAM_LIMITER.acquire()
+
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(
+            TELEGRAM_SEND_URL, json=payload, timeout=TELEGRAM_TIMEOUT
+        )
         response.raise_for_status()
         print(f"Sent notification for: {title}")
         return True
@@ -144,16 +125,50 @@ def send_telegram_message(
         return False
 
 
-def load_history() -> dict:
+def load_history() -> tuple[dict, bool]:
+    """
+    Returns the history snapshot with any sends logged by an unfinished run
+    replayed on top, and whether there were any to replay.
+    """
+    history = {}
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    return {}
+        with open(HISTORY_FILE, "rb") as f:
+            history = orjson.loads(f.read())
+
+    replayed = False
+    if os.path.exists(SEND_LOG_FILE):
+        with open(SEND_LOG_FILE, "rb") as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                ids = history.setdefault(record["feed"], [])
+                if record["id"] not in ids:
+                    ids.append(record["id"])
+                    replayed = True
+
+    return history, replayed
+
+
+def log_sent(name: str, post_id: str) -> None:
+    # Unbuffered append: the record is on disk before the next send starts
+    with open(SEND_LOG_FILE, "ab", buffering=0) as f:
+        f.write(orjson.dumps({"feed": name, "id": post_id}) + b"\n")
 
 
 def save_history(history: dict) -> None:
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+    # Write to a temp file and swap it in, so an interrupted run can never
+    # leave a truncated history behind
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(history))
+    os.replace(tmp_file, HISTORY_FILE)
+
+    # Everything logged is in the snapshot now
+    if os.path.exists(SEND_LOG_FILE):
+        open(SEND_LOG_FILE, "wb").close()
 
 
 def check_feeds() -> None:
@@ -164,19 +179,40 @@ def check_feeds() -> None:
     with open(CONFIG_FILE, "r") as f:
         feeds = json.load(f)
 
-    history = load_history()
+    history, updated_history = load_history()
+    validators = history.setdefault(VALIDATORS_KEY, {})
     now_utc = datetime.now(timezone.utc)
 
     print(f"Checking all {len(feeds)} feeds...")
 
-    updated_history = False
+    # Several names may point at the same feed; download and parse it once
+    feeds_by_url = defaultdict(list)
+    for feed_config in feeds:
+        feeds_by_url[feed_config["url"]].append(feed_config)
+
+    # Download all feeds concurrently; parsing, history and notifications
+    # stay sequential
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = {}
+        for url, url_feeds in feeds_by_url.items():
+            # Revalidate only if every name sharing the URL is on the same version
+            cached = [validators.get(c["name"], {}) for c in url_feeds]
+            if any(c != cached[0] for c in cached):
+                cached = [{}]
+            futures[url] = executor.submit(
+                fetch_feed, _SESSION, url, cached[0], FETCH_TIMEOUT
+            )
+
+    # Collect new entries from every feed first, then send them all in one
+    # chronological pass paced by the shared Telegram limiter
+    entries_to_send = []
+    new_validators = {}
+    parsed_feeds = {}
+    sent_feeds = set()
 
     for feed_config in feeds:
         name = feed_config["name"]
         url = feed_config["url"]
-        rhash = feed_config.get("rhash")
-        force_slash = feed_config.get("force_slash", False)
-        cache_burst = feed_config.get("cache_burst", False)
 
         if name not in history:
             history[name] = []
@@ -188,45 +224,89 @@ def check_feeds() -> None:
         print(f"Checking {name}...")
 
         try:
-            feed = feedparser.parse(url)
+            resp = futures[url].result()
         except Exception as e:
-            print(f"Failed to parse {url}: {e}")
+            print(f"Failed to fetch {url}: {e}")
             continue
 
-        time_threshold = now_utc - timedelta(hours=lookback_hours)
-        entries_to_send = []
+        if resp.status_code == 304:
+            print(f"[{name}] Feed not modified.")
+            continue
+
+        if url not in parsed_feeds:
+            # feedparser expects lower-case header names; content-location
+            # gives it the base URL for resolving relative links
+            response_headers = {k.lower(): v for k, v in resp.headers.items()}
+            response_headers.setdefault("content-location", resp.url)
+
+            try:
+                parsed_feeds[url] = feedparser.parse(
+                    resp.content, response_headers=response_headers
+                )
+            except Exception as e:
+                print(f"Failed to parse {url}: {e}")
+                continue
+
+        feed = parsed_feeds[url]
+
+        feed_validators = {
+            "etag": resp.headers.get("ETag"),
+            "modified": resp.headers.get("Last-Modified"),
+        }
+        if any(feed_validators.values()) and feed_validators != validators.get(name):
+            new_validators[name] = feed_validators
+
+        threshold_ts = (now_utc - timedelta(hours=lookback_hours)).timestamp()
+        # History stays a list on disk (for trimming); look ids up in a set
+        seen = set(history[name])
 
         for entry in feed.entries:
             post_id = entry.get("id", entry.get("link"))
 
-            if post_id in history[name]:
+            if post_id in seen:
                 continue
 
-            entry_date = get_entry_date(entry)
+            entry_ts = get_entry_timestamp(entry)
 
-            if not entry_date:
+            if entry_ts is None:
                 continue
 
-            if entry_date > time_threshold:
-                entries_to_send.append((entry_date, entry, post_id))
+            if entry_ts > threshold_ts:
+                seen.add(post_id)
+                entries_to_send.append((entry_ts, entry, post_id, feed_config))
 
-        entries_to_send.sort(key=lambda x: x[0])
+    entries_to_send.sort(key=lambda x: x[0])
 
-        for entry_date, entry, post_id in entries_to_send:
-            print(f"New post found: {entry.get('title')}")
-
-            success = send_telegram_message(
-                entry, name, entry_date, rhash, force_slash, cache_burst
-            )
+    for entry_ts, entry, post_id, feed_config in entries_to_send:
+        name = feed_config["name"]
+        entry_date = datetime.fromtimestamp(entry_ts, tz=timezone.utc)
+        print(f"New post found: {entry.get('title')}")
+
+        success = send_telegram_message(
+            entry,
+            name,
+            entry_date,
+            feed_config.get("rhash"),
+            feed_config.get("force_slash", False),
+            feed_config.get("cache_burst", False),
+        )
+
+        if success:
+            history[name].append(post_id)
+            log_sent(name, post_id)
+            sent_feeds.add(name)
+            updated_history = True
+        else:
+            # Fetch this feed in full next run so the failed post is retried
+            new_validators[name] = {}
 
-            if success:
-                history[name].append(post_id)
-                updated_history = True
-                time.sleep(1)
+    if new_validators:
+        validators.update(new_validators)
+        updated_history = True
 
-        # Keep history manageable
-        if len(history[name]) > 50:
-            history[name] = history[name][-50:]
+    # Keep history manageable; only feeds that got new ids can have grown
+    for name in sent_feeds:
+        del history[name][:-MAX_HISTORY_PER_FEED]
 
     if updated_history:
         save_history(history)
@@ -1,64 +1,63 @@
+import argparse
+import html
 import json
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from functools import lru_cache, partial
 
 import feedparser
-import requests
-from bs4 import BeautifulSoup
-from dateutil import parser as date_parser
-from google.genai import Client, types
+import orjson
+
+from feed_utils import (
+    clean_summary,
+    fetch_feed,
+    format_date_for_display,
+    get_entry_date,
+)
+from http_utils import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    TELEGRAM_LIMITER,
+    TELEGRAM_SEND_URL,
+    TELEGRAM_TIMEOUT,
+    make_session,
+)
 
 CONFIG_FILE = "config/youtube_feeds.json"
 HISTORY_FILE = "youtube_history.json"
-TARGET_TZ = ZoneInfo("Asia/Tehran")
+# Per-feed ETag / Last-Modified validators, kept alongside the id lists
+VALIDATORS_KEY = "__validators__"
+# AI summaries by video id, so a retried or repeated video isn't summarized twice
+SUMMARY_CACHE_KEY = "__summaries__"
+
+# --- Constants ---
+MAX_FETCH_WORKERS = 4
+FETCH_TIMEOUT = 15
+MAX_HISTORY_PER_FEED = 20
+MAX_SUMMARY_WORKERS = 4
+SUMMARY_CACHE_DAYS = 30
+# Three or more new videos from one channel are combined into as few messages
+# as fit Telegram's 4096-character limit
+BATCH_MIN_ENTRIES = 3
+BATCH_SEPARATOR = "\n---\n\n"
+TELEGRAM_MAX_CHARS = 4000
+# A zero-width space before the colon keeps Telegram from treating the time
+# as a clickable timestamp
+DISPLAY_TIME_SEP = "\u200b:"
+
+_SESSION = make_session(MAX_FETCH_WORKERS)
+
+TELEGRAM_TOPIC_ID = os.environ.get("TELEGRAM_YOUTUBE_TOPIC_ID")
 
 # --- Helper Functions ---
 
+_VIDEO_ID_RE = re.compile(r"[?&]v=([^&]+)")
 
-def clean_summary(html_content: str, word_limit: int = 50) -> str:
-    if not html_content:
-        return ""
-    soup = BeautifulSoup(html_content, "html.parser")
-    text = soup.get_text(separator=" ")
-    words = text.split()
-    if len(words) > word_limit:
-        return " ".join(words[:word_limit]) + "..."
-    return " ".join(words)
 
-
-def get_entry_date(entry) -> datetime:
-    if "published" in entry:
-        date_str = entry.published
-    elif "updated" in entry:
-        date_str = entry.updated
-    else:
-        return None
-
-    try:
-        dt = date_parser.parse(date_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        else:
-            dt = dt.astimezone(timezone.utc)
-        return dt
-    except Exception:
-        return None
-
-
-def format_date_for_display(dt_utc: datetime) -> str:
-    try:
-        dt_local = dt_utc.astimezone(TARGET_TZ)
-        return dt_local.strftime("%Y-%m-%d %H\u200b:%M")
-    except Exception:
-        return "Unknown Date"
-
-
-def is_youtube_short(entry: dict) -> bool:
-    link = entry.get("link", "")
-    title = entry.get("title", "")
+def is_youtube_short(link: str, title: str) -> bool:
     if "/shorts/" in link:
         return True
     if "#shorts" in title.lower():
@@ -66,14 +65,13 @@ def is_youtube_short(entry: dict) -> bool:
     return False
 
 
-def get_video_id_from_entry(entry: dict) -> str:
+def get_video_id_from_entry(entry: dict, link: str) -> str:
     # Method 1: yt_videoid extension
     if "yt_videoid" in entry:
         return entry.yt_videoid
 
     # Method 2: Extract from link
-    link = entry.get("link", "")
-    match = re.search(r"[?&]v=([^&]+)", link)
+    match = _VIDEO_ID_RE.search(link)
     if match:
         return match.group(1)
 
@@ -83,6 +81,15 @@ def get_video_id_from_entry(entry: dict) -> str:
 # --- AI & Transcript Functions ---
 
 
+@lru_cache(maxsize=1)
+def _genai_client(api_key: str):
+    # google.genai is slow to import and only needed with --ai
+    from google.genai import Client
+
+    # One client per run, so its connection pool is reused across summaries
+    return Client(api_key=api_key)
+
+
 def generate_ai_summary(link: str | None) -> str:
     if not link:
         raise ValueError(f"Invalid link: {link}")
@@ -90,7 +97,9 @@ def generate_ai_summary(link: str | None) -> str:
     if not api_key:
         raise ValueError("GOOGLE_API_KEY is missing.")
 
-    client = Client(api_key=api_key)
+    from google.genai import types
+
+    client = _genai_client(api_key)
 
     system_prompt = (
         "You are an expert content summarizer. Your task is to summarize the following YouTube video. "
@@ -129,46 +138,135 @@ def generate_ai_summary(link: str | None) -> str:
     return ""
 
 
-# --- Notification Function ---
+def get_ai_summary(video_id: str, link: str, summary_cache: dict) -> str:
+    cached = summary_cache.get(video_id)
+    if cached:
+        return cached["text"]
 
+    print(f"Attempting to generate summary for {link}...")
+    ai_summary = generate_ai_summary(link)
+    if ai_summary:
+        summary_cache[video_id] = {"text": ai_summary, "at": int(time.time())}
+    return ai_summary
 
-def send_telegram_message(
-    entry: dict, channel_name: str, dt_utc: datetime, summary_text: str
-) -> bool:
-    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
-    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
-    topic_id = os.environ.get("TELEGRAM_YOUTUBE_TOPIC_ID")
 
-    if not bot_token or not chat_id:
-        print("Error: Missing Telegram secrets.")
-        return False
+def build_summary(
+    entry, link: str, use_ai: bool = False, summary_cache: dict | None = None
+) -> str:
+    """
+    Returns the HTML summary for a video: the AI summary when enabled and
+    available, otherwise the cleaned feed description.
+    """
+    final_summary = ""
+    video_id = get_video_id_from_entry(entry, link)
+    used_fallback = True
+
+    if use_ai and video_id:
+        try:
+            ai_summary = get_ai_summary(
+                video_id,
+                link,
+                summary_cache if summary_cache is not None else {},
+            )
+            if ai_summary:
+                final_summary = (
+                    "✨ <b>AI Summary:</b>\n"
+                    f"{html.escape(ai_summary, quote=False)}"
+                )
+                used_fallback = False
+        except Exception as e:
+            print(
+                f"AI Summary skipped due to: {e}. Reverting to standard description."
+            )
+            used_fallback = True
+
+    if used_fallback:
+        raw_summary = entry.get("summary", entry.get("description", ""))
+        final_summary = html.escape(
+            clean_summary(raw_summary, word_limit=80), quote=False
+        )
+
+    return final_summary
 
-    title = entry.get("title", "No Title")
-    link = entry.get("link", "")
 
+# --- Notification Function ---
+
+
+def format_video(title: str, link: str, dt_utc: datetime, summary_text: str) -> str:
+    """HTML for one video: linked title, summary and date."""
     summary_section = f"{summary_text}\n\n" if summary_text else ""
-    published_display = format_date_for_display(dt_utc) if dt_utc else "Unknown Date"
+    published_display = (
+        format_date_for_display(dt_utc, DISPLAY_TIME_SEP) if dt_utc else "Unknown Date"
+    )
 
-    message = (
-        f"🎥 <b>{channel_name}</b>\n\n"
-        f"<a href='{link}'><b>{title}</b></a>\n\n"
+    # summary_text is already HTML; everything else is escaped here
+    return (
+        f"<a href='{html.escape(link)}'>"
+        f"<b>{html.escape(title or 'No Title', quote=False)}</b></a>\n\n"
         f"{summary_section}"
         f"📅 {published_display}\n"
     )
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+
+def build_messages(channel_name: str, videos: list) -> list:
+    """
+    Turns a channel's new videos, given as (title, link, dt_utc, summary,
+    post_id) tuples, into (message, [(post_id, title, link), ...]) pairs.
+    Each video gets its own message unless there are at least
+    BATCH_MIN_ENTRIES, in which case they are packed into as few messages as
+    Telegram's length limit allows.
+    """
+    header = f"🎥 <b>{html.escape(channel_name, quote=False)}</b>\n\n"
+
+    if len(videos) < BATCH_MIN_ENTRIES:
+        return [
+            (
+                header + format_video(title, link, dt_utc, summary),
+                [(post_id, title, link)],
+            )
+            for title, link, dt_utc, summary, post_id in videos
+        ]
+
+    messages = []
+    body, items = "", []
+    for title, link, dt_utc, summary, post_id in videos:
+        part = format_video(title, link, dt_utc, summary)
+        # HTML length overestimates the visible text Telegram counts, so this
+        # stays under the limit
+        if items and (
+            len(header) + len(body) + len(BATCH_SEPARATOR) + len(part)
+            > TELEGRAM_MAX_CHARS
+        ):
+            messages.append((header + body, items))
+            body, items = "", []
+        body = body + BATCH_SEPARATOR + part if items else part
+        items.append((post_id, title, link))
+
+    if items:
+        messages.append((header + body, items))
+    return messages
+
+
+def send_telegram_message(message: str, preview_link: str) -> bool:
+    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+        print("Error: Missing Telegram secrets.")
+        return False
+
     payload = {
-        "chat_id": chat_id,
-        "message_thread_id": topic_id,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "message_thread_id": TELEGRAM_TOPIC_ID,
         "text": message,
         "parse_mode": "HTML",
-        "link_preview_options": {"url": link},
+        "link_preview_options": {"url": preview_link},
     }
 
+    TELEGRAM_LIMITER.acquire()
+
     try:
-        response = requests.post(url, json=payload)
+        response = _SESSION.post(
+            TELEGRAM_SEND_URL, json=payload, timeout=TELEGRAM_TIMEOUT
+        )
         response.raise_for_status()
-        print(f"Sent notification for: {title}")
         return True
     except Exception as e:
         print(f"Failed to send Telegram message: {e}")
@@ -178,31 +276,69 @@ def send_telegram_message(
 # --- Main Logic ---
 
 
+@lru_cache(maxsize=4)
+def _read_config(path: str, mtime: float) -> list:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_feeds() -> list:
+    # Keyed on mtime, so repeated checks in one process only re-read the
+    # config after it has been edited
+    return _read_config(CONFIG_FILE, os.path.getmtime(CONFIG_FILE))
+
+
 def load_history() -> dict:
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
+        with open(HISTORY_FILE, "rb") as f:
+            return orjson.loads(f.read())
     return {}
 
 
 def save_history(history: dict) -> None:
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+    # Write to a temp file and swap it in, so an interrupted run can never
+    # leave a truncated history behind
+    tmp_file = HISTORY_FILE + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(orjson.dumps(history))
+    os.replace(tmp_file, HISTORY_FILE)
 
 
-def check_feeds() -> None:
+def check_feeds(use_ai: bool = False) -> None:
     if not os.path.exists(CONFIG_FILE):
         print(f"Error: Config file not found at {CONFIG_FILE}")
         return
 
-    with open(CONFIG_FILE, "r") as f:
-        feeds = json.load(f)
+    feeds = load_feeds()
 
     history = load_history()
+    validators = history.setdefault(VALIDATORS_KEY, {})
     now = datetime.now(timezone.utc)
     updated_history = False
 
-    for feed_config in feeds:
+    summary_cache = history.setdefault(SUMMARY_CACHE_KEY, {})
+    cache_cutoff = now.timestamp() - SUMMARY_CACHE_DAYS * 86400
+    for video_id in [v for v, c in summary_cache.items() if c["at"] < cache_cutoff]:
+        del summary_cache[video_id]
+        updated_history = True
+    cached_summaries = len(summary_cache)
+
+    # Download all feeds concurrently over the shared session (every channel
+    # feed is on www.youtube.com); parsing, history and notifications stay
+    # sequential
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                fetch_feed,
+                _SESSION,
+                feed_config["url"],
+                validators.get(feed_config["name"], {}),
+                FETCH_TIMEOUT,
+            )
+            for feed_config in feeds
+        ]
+
+    for feed_config, future in zip(feeds, futures):
         name = feed_config["name"]
         url = feed_config["url"]
 
@@ -211,20 +347,55 @@ def check_feeds() -> None:
 
         print(f"Checking {name}...")
         try:
-            feed = feedparser.parse(url)
+            resp = future.result()
+        except Exception as e:
+            print(f"Failed to fetch {url}: {e}")
+            continue
+
+        if resp.status_code == 304:
+            print(f"[{name}] Feed not modified.")
+            continue
+
+        # YouTube's Atom feeds are well-formed and every field we use is
+        # stripped and escaped before sending, so feedparser's sanitizer and
+        # relative-link resolution are skipped
+        try:
+            feed = feedparser.parse(
+                resp.content,
+                response_headers={k.lower(): v for k, v in resp.headers.items()},
+                sanitize_html=False,
+                resolve_relative_uris=False,
+            )
         except Exception as e:
             print(f"Failed to parse {url}: {e}")
             continue
 
+        feed_validators = {
+            "etag": resp.headers.get("ETag"),
+            "modified": resp.headers.get("Last-Modified"),
+        }
+        if not any(feed_validators.values()):
+            feed_validators = None
+
         hours_lookback = 30
         time_threshold = now - timedelta(hours=hours_lookback)
 
         entries_to_send = []
+        # History stays a list on disk (for trimming); look ids up in a set
+        seen = set(history[name])
 
         for entry in feed.entries:
-            post_id = entry.get("id", entry.get("link"))
+            # Look the fields up once; FeedParserDict access isn't free
+            link = entry.get("link", "")
+            post_id = entry.get("id", link)
+
+            if post_id in seen:
+                continue
 
-            if post_id in history[name]:
+            # Cheapest checks first: the Shorts test is plain substring matching
+            title = entry.get("title", "")
+            if is_youtube_short(link, title):
+                print(f"Skipping YouTube Short: {title}")
                 continue
 
             entry_date = get_entry_date(entry)
@@ -232,54 +403,66 @@ def check_feeds() -> None:
             if not entry_date:
                 continue
 
-            if is_youtube_short(entry):
-                print(f"Skipping YouTube Short: {entry.get('title')}")
-                continue
-
             if entry_date > time_threshold:
-                entries_to_send.append((entry_date, entry, post_id))
+                seen.add(post_id)
+                entries_to_send.append((entry_date, entry, post_id, link, title))
 
         entries_to_send.sort(key=lambda x: x[0])
 
-        for entry_date, entry, post_id in entries_to_send:
-            title = entry.get("title")
-            print(f"New video found: {title}")
+        # A summary can mean a multi-second Gemini call, so build them all up
+        # front in parallel; the sends below stay in order
+        with ThreadPoolExecutor(max_workers=MAX_SUMMARY_WORKERS) as executor:
+            summaries = list(
+                executor.map(
+                    partial(build_summary, use_ai=use_ai, summary_cache=summary_cache),
+                    [entry for _, entry, _, _, _ in entries_to_send],
+                    [link for _, _, _, link, _ in entries_to_send],
+                )
+            )
+
+        videos = [
+            (title, link, entry_date, final_summary, post_id)
+            for (entry_date, _, post_id, link, title), final_summary in zip(
+                entries_to_send, summaries
+            )
+        ]
 
-            # --- AI Summary Logic ---
-            final_summary = ""
-            video_id = get_video_id_from_entry(entry)
-            used_fallback = True
+        for message, items in build_messages(name, videos):
+            for _, title, _ in items:
+                print(f"New video found: {title}")
 
-            # if video_id:
-            #     try:
-            #         print(f"Attempting to generate summary for {entry.get('link')}...")
-            #         ai_summary = generate_ai_summary(entry.get("link"))
-            #         if ai_summary:
-            #             final_summary = f"✨ <b>AI Summary:</b>\n{ai_summary}"
-            #             used_fallback = False
-            #     except Exception as e:
-            #         print(
-            #             f"AI Summary skipped due to: {e}. Reverting to standard description."
-            #         )
-            #         used_fallback = True
-
-            if used_fallback:
-                raw_summary = entry.get("summary", entry.get("description", ""))
-                final_summary = clean_summary(raw_summary, word_limit=80)
-
-            success = send_telegram_message(entry, name, entry_date, final_summary)
-
-            if success:
-                history[name].append(post_id)
+            # The preview shows the first video in the message
+            if send_telegram_message(message, items[0][2]):
+                for post_id, title, _ in items:
+                    print(f"Sent notification for: {title or 'No Title'}")
+                    history[name].append(post_id)
                 updated_history = True
-                time.sleep(1)
+            else:
+                # Fetch this feed in full next run so the failed videos are retried
+                feed_validators = {}
+
+        if feed_validators is not None and feed_validators != validators.get(name):
+            validators[name] = feed_validators
+            updated_history = True
 
-        if len(history[name]) > 20:
-            history[name] = history[name][-20:]
+        # Only a feed that got new ids can have grown past the cap
+        if entries_to_send:
+            del history[name][:-MAX_HISTORY_PER_FEED]
+
+    if len(summary_cache) != cached_summaries:
+        updated_history = True
 
     if updated_history:
         save_history(history)
 
 
 if __name__ == "__main__":
-    check_feeds()
+    parser = argparse.ArgumentParser(description="Check YouTube feeds for new videos")
+    parser.add_argument(
+        "--ai",
+        action="store_true",
+        help="summarize new videos with Gemini (needs GOOGLE_API_KEY)",
+    )
+    args = parser.parse_args()
+
+    check_feeds(use_ai=args.ai)